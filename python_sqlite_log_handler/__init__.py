@@ -1,12 +1,150 @@
 import atexit
 import logging
+import os
 import sqlite3
 import threading
+import time
 import json
+import math
+import queue
 import traceback
-from datetime import datetime
+from collections import deque
+from collections.abc import Mapping
+from datetime import date, time as dt_time
+from enum import Enum
+from itertools import chain, islice
 from logging.handlers import BufferingHandler
-from typing import Any, Dict, List, Optional, Tuple, Union
+from operator import attrgetter
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Attributes every LogRecord carries; anything else was passed via ``extra``
+_STANDARD_LOGRECORD_ATTRS = frozenset(
+    vars(logging.makeLogRecord({})).keys()) | {"message", "asctime"}
+
+# Used for stack_info when no formatter is configured
+_DEFAULT_FORMATTER = logging.Formatter()
+
+# Columns copied verbatim from LogRecord attributes, as (column, attribute)
+_RECORD_ATTR_COLUMNS = (
+    ("level", "levelno"),
+    ("level_name", "levelname"),
+    ("logger_name", "name"),
+    ("function_name", "funcName"),
+    ("module", "module"),
+    ("filename", "pathname"),
+    ("line_number", "lineno"),
+    ("process_id", "process"),
+    ("process_name", "processName"),
+    ("thread_id", "thread"),
+    ("thread_name", "threadName"),
+)
+
+# Fetches all of the above in one C-level call, returning a tuple
+_get_record_attrs = attrgetter(*(attr for _, attr in _RECORD_ATTR_COLUMNS))
+
+# PRAGMA synchronous value for each durability level
+_SYNCHRONOUS_MODES = {
+    "full": "FULL",
+    "normal": "NORMAL",
+    "off": "OFF",
+}
+
+# Rough per-row size of the fixed columns, used to estimate buffered bytes
+_RECORD_OVERHEAD_BYTES = 256
+# Assumed size of a traceback that has not been rendered yet
+_TRACEBACK_ESTIMATE_BYTES = 4096
+# Assumed size of a message or argument that is not a str or bytes
+_VALUE_ESTIMATE_BYTES = 32
+
+# Rows bound by each multi-row INSERT. A single fixed size keeps one
+# prepared statement in the sqlite3 statement cache for every batch
+_ROWS_PER_STATEMENT = 100
+
+
+def _json_default(value: Any) -> Any:
+    """Convert values JSON can't represent, the same way with or without orjson."""
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, tuple):
+        # Tuple subclasses such as namedtuples, which json encodes as arrays
+        return list(value)
+    return str(value)
+
+
+def _replace_non_finite(value: Any) -> Any:
+    """Replace NaN and infinities with None, as orjson does."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    return value
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    """Serialize with the standard library, matching orjson's output."""
+    try:
+        return json.dumps(obj, default=_json_default, allow_nan=False,
+                          separators=(',', ':'))
+    except ValueError:
+        return json.dumps(_replace_non_finite(obj), default=_json_default,
+                          allow_nan=False, separators=(',', ':'))
+
+
+def _dumps(obj: Dict[str, Any]) -> str:
+    """
+    Serialize to strict JSON, storing non-serializable values as strings.
+
+    orjson is used when installed; the standard library fallback produces
+    the same output: compact separators, ISO dates, null for NaN, arrays
+    for namedtuples and str() for dataclasses.
+    """
+    if orjson is not None:
+        try:
+            # pylint: disable=no-member
+            return orjson.dumps(
+                obj, default=_json_default,
+                option=(orjson.OPT_PASSTHROUGH_DATETIME |
+                        orjson.OPT_PASSTHROUGH_DATACLASS |
+                        orjson.OPT_NON_STR_KEYS)).decode()
+            # pylint: enable=no-member
+        except TypeError:
+            # e.g. integers wider than 64 bits, which orjson rejects
+            pass
+
+    try:
+        return _stdlib_dumps(obj)
+    except (TypeError, ValueError, RecursionError):
+        # e.g. non-str keys nested in a value, which default= never sees;
+        # store just the offending entries as strings
+        safe = {}
+        for key, value in obj.items():
+            try:
+                _stdlib_dumps(value)
+                safe[key] = value
+            except (TypeError, ValueError, RecursionError):
+                safe[key] = str(value)
+        return _stdlib_dumps(safe)
+
+
+def _compile_field_getter(field_names: List[str]) -> Callable[[logging.LogRecord], Tuple[Any, ...]]:
+    """
+    Generate a function returning the given record attributes as a tuple,
+    with None for missing ones. The names are embedded as string literals,
+    so the function is straight-line code with no loop over the fields.
+    """
+    items = ''.join(f"getattr(record, {name!r}, None), " for name in field_names)
+    namespace = {}
+    exec(f"def get_fields(record):\n    return ({items})\n", namespace)  # pylint: disable=W0122
+    return namespace['get_fields']
 
 
 class SQLiteLogHandler(BufferingHandler):
@@ -16,69 +154,144 @@ class SQLiteLogHandler(BufferingHandler):
     """
 
     def __init__(self,
-                 db_path: str,
+                 db_path: Union[str, os.PathLike],
                  table_name: str = 'logs',
                  capacity: int = 1000,
                  flush_interval: float = 5.0,
-                 additional_fields: Optional[List[Tuple[str, str]]] = None):
+                 flush_num_bytes: int = 1024 * 1024,
+                 queue_size: int = 100,
+                 additional_fields: Optional[List[Tuple[str, str]]] = None,
+                 defer_indexes: bool = False,
+                 durability: Literal["full", "normal", "off"] = "normal"):
         """
         Initialize the handler with the path to the SQLite database.
 
         Args:
-            db_path: Path to the SQLite database file
+            db_path: Path to the SQLite database file, or a "file:" URI
             table_name: Name of the table to store logs
             capacity: Number of records to buffer before writing to disk
             flush_interval: Time in seconds between periodic flushes
+            flush_num_bytes: Estimated buffered size in bytes that triggers a flush
+            queue_size: Number of batches waiting to be written before emit() blocks
             additional_fields: List of (name, type) for additional columns to create
+            defer_indexes: Skip index creation until build_indexes() is called
+            durability: SQLite synchronous mode, "full", "normal" or "off". With
+                "off" an OS crash or power loss can lose recent logs or
+                corrupt the database
         """
+        if durability not in _SYNCHRONOUS_MODES:
+            raise ValueError(
+                f"durability must be one of {', '.join(_SYNCHRONOUS_MODES)}, got {durability!r}")
+
         # Initialize with buffer capacity
         super().__init__(capacity)
 
         self.db_path = db_path
         self.table_name = table_name
         self.flush_interval = flush_interval
+        self.flush_num_bytes = flush_num_bytes
+        self._buffered_bytes = 0
+        self.queue_size = queue_size
         self.additional_fields = additional_fields or []
-
-        # Thread local storage for database connections
-        self.local = threading.local()
+        self.defer_indexes = defer_indexes
+        self.durability = durability
+
+        # Columns are fixed at construction, so the INSERT statement is too
+        self._columns = [column for column, _ in _RECORD_ATTR_COLUMNS] + [
+            "created_at",
+            "message",
+            "exception",
+            "stack_trace",
+            "extra"
+        ] + [field_name for field_name, _ in self.additional_fields]
+        self._insert_sql_prefix = (
+            f"INSERT INTO {self.table_name} ({', '.join(self._columns)}) VALUES ")
+        self._row_placeholder = f"({', '.join(['?'] * len(self._columns))})"
+        self._insert_sql = self._insert_sql_prefix + self._row_placeholder
+        self._extra_skip_keys = _STANDARD_LOGRECORD_ATTRS | {
+            field_name for field_name, _ in self.additional_fields}
+        self._get_additional_fields = _compile_field_getter(
+            [field_name for field_name, _ in self.additional_fields])
 
         # Lock for thread safety
         self.lock = threading.RLock()
 
+        # Guards the buffer. Kept apart from the handler lock above, which
+        # logging.shutdown() and dictConfig() hold around flush(); the writer
+        # thread must never need it while flush() waits on the queue
+        self._buffer_lock = threading.RLock()
+
+        # Serializes use of the single writer connection
+        self._write_lock = threading.Lock()
+
+        # Deque appends are cheap and the whole buffer is swapped on flush
+        self.buffer = deque()
+        # When the oldest record in the buffer was added, for periodic flushes
+        self._buffer_since = None
+
+        # Wakes the writer thread; shares the buffer lock
+        self._flush_condition = threading.Condition(self._buffer_lock)
+        self._stopping = False
+
+        # Single connection, used by the writer thread for every insert
+        self._writer_conn = self._connect()
+
         # Initialize the database
         self._initialize_db()
 
+        # Rows per multi-row INSERT, bounded by the host parameter limit
+        max_variables = self._writer_conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+        self._rows_per_statement = min(
+            _ROWS_PER_STATEMENT, max_variables // len(self._columns))
+        self._multi_row_insert_sql = self._insert_sql_prefix + ', '.join(
+            [self._row_placeholder] * self._rows_per_statement)
+
         self._closed = False
 
-        # Start background flush thread
+        # Full batches are handed over to the writer thread through this queue
+        self._queue = queue.Queue(maxsize=self.queue_size)
+
+        # Start background writer thread
         self._start_flush_thread()
 
         # Ensure flush and cleanup on interpreter exit
         atexit.register(self.close)
 
-    def _get_conn(self) -> sqlite3.Connection:
-        """Get a thread-local database connection."""
-        if not hasattr(self.local, 'conn'):
-            self.local.conn = sqlite3.connect(self.db_path)
-            # Enable WAL mode for better concurrency
-            self.local.conn.execute('PRAGMA journal_mode=WAL')
-            # Disable synchronous writes for better performance
-            self.local.conn.execute('PRAGMA synchronous=NORMAL')
-            # Increase cache size
-            self.local.conn.execute('PRAGMA cache_size=-10000')  # ~10MB cache
-            # Enable memory-mapped I/O
-            self.local.conn.execute('PRAGMA mmap_size=268435456')  # 256MB
-        return self.local.conn
+    def _connect(self) -> sqlite3.Connection:
+        """Open a database connection configured for logging workloads."""
+        # Autocommit mode; transactions are managed explicitly in flush()
+        # No type detection: values are only ever written, never converted back
+        # Created here but used from the writer thread, hence check_same_thread
+        # "file:" paths are URIs, e.g. "file:logs?mode=memory&cache=shared"
+        conn = sqlite3.connect(
+            self.db_path, detect_types=0, isolation_level=None,
+            check_same_thread=False,
+            uri=isinstance(self.db_path, str) and self.db_path.startswith('file:'))
+        # Larger pages suit wide log rows; only effective on a new database,
+        # so it must run before WAL mode is enabled and tables are created
+        conn.execute('PRAGMA page_size=16384')
+        # Enable WAL mode for better concurrency
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Trade durability for write performance, NORMAL unless configured
+        conn.execute(f'PRAGMA synchronous={_SYNCHRONOUS_MODES[self.durability]}')
+        # Increase cache size
+        conn.execute('PRAGMA cache_size=-10000')  # ~10MB cache
+        # Enable memory-mapped I/O
+        conn.execute('PRAGMA mmap_size=268435456')  # 256MB
+        # Keep temporary tables and indices in memory
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # Checkpoint the WAL less often
+        conn.execute('PRAGMA wal_autocheckpoint=10000')  # pages
+        return conn
 
     def _initialize_db(self) -> None:
         """Initialize the database table if it doesn't exist."""
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        cursor = self._writer_conn.cursor()
 
         # Build the basic schema
         schema = [
             "id INTEGER PRIMARY KEY AUTOINCREMENT",
-            "created_at TIMESTAMP NOT NULL",
+            "created_at INTEGER NOT NULL",  # microseconds since the epoch
             "level INTEGER NOT NULL",
             "level_name TEXT NOT NULL",
             "logger_name TEXT NOT NULL",
@@ -115,139 +328,289 @@ class SQLiteLogHandler(BufferingHandler):
             f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_logger_name ON {self.table_name} (logger_name)"
         ]
 
+        # Bulk loads are faster without indexes to maintain
+        if self.defer_indexes:
+            self._pending_indexes = indexes
+            return
+
+        self._pending_indexes = []
         for index_sql in indexes:
             cursor.execute(index_sql)
 
-        conn.commit()
-
-    def _start_flush_thread(self) -> None:
-        """Start a background thread to periodically flush the buffer."""
-        if self.flush_interval <= 0:
+    def build_indexes(self) -> None:
+        """Create the indexes skipped because of defer_indexes, in one transaction."""
+        if not self._pending_indexes:
             return
 
+        with self._write_lock:
+            cursor = self._writer_conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for index_sql in self._pending_indexes:
+                    cursor.execute(index_sql)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+        self._pending_indexes = []
+
+    def _start_flush_thread(self) -> None:
+        """Start the background thread that writes batches to the database."""
         self.flush_thread = threading.Thread(
             target=self._flush_thread_run,
             daemon=True,
             name="SQLiteLogHandler-Flush"
         )
-        self.flush_thread_stop = threading.Event()
         self.flush_thread.start()
 
     def _flush_thread_run(self) -> None:
-        """Background thread that periodically flushes the buffer."""
-        while not self.flush_thread_stop.wait(self.flush_interval):
-            self.flush()
+        """
+        Background thread that writes queued batches, and flushes the buffer
+        once its oldest record has waited flush_interval seconds. It sleeps
+        without timeout while there is nothing to write.
+        """
+        interval = self.flush_interval if self.flush_interval > 0 else None
+
+        while True:
+            with self._flush_condition:
+                due = False
+                while not self._stopping and self._queue.empty():
+                    timeout = None
+                    if interval is not None and self._buffer_since is not None:
+                        timeout = self._buffer_since + interval - time.monotonic()
+                        if timeout <= 0:
+                            due = True
+                            break
+                    self._flush_condition.wait(timeout)
+
+                # Producers check _stopping under this lock before queueing,
+                # so nothing can be queued after this decision
+                if self._stopping and self._queue.empty():
+                    break
+
+            # Write handed over batches first, in order
+            while True:
+                try:
+                    records = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._write_records(records)
+                finally:
+                    self._queue.task_done()
+                    # Wake producers waiting for room in the queue
+                    with self._flush_condition:
+                        self._flush_condition.notify_all()
+
+            if due:
+                self._write_records(self._take_buffer())
+
+    def handle(self, record: logging.LogRecord) -> Union[bool, logging.LogRecord]:
+        """
+        Filter and emit the record.
+
+        Unlike logging.Handler.handle, the handler lock is not held around
+        emit(), which takes the buffer lock itself only while touching the
+        buffer.
+        """
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
 
     def emit(self, record: logging.LogRecord) -> None:
         """Add the record to the buffer."""
-        with self.lock:
+        with self._buffer_lock:
             self.buffer.append(record)
-            if len(self.buffer) >= self.capacity:
-                self.flush()
-
-    def _extract_record_data(self, record: logging.LogRecord) -> Dict[str, Any]:
-        """Extract all useful data from the log record."""
-        # Basic record info
-        data = {
-            "created_at": datetime.fromtimestamp(record.created).isoformat(),
-            "level": record.levelno,
-            "level_name": record.levelname,
-            "logger_name": record.name,
-            "message": self.format(record),
-            "function_name": record.funcName,
-            "module": record.module,
-            "filename": record.pathname,
-            "line_number": record.lineno,
-            "process_id": record.process,
-            "process_name": record.processName,
-            "thread_id": record.thread,
-            "thread_name": record.threadName,
-            "exception": None,
-            "stack_trace": None,
-            "extra": None
-        }
-
-        # Handle exception info if present
-        if record.exc_info:
-            data["exception"] = str(record.exc_info[1])
-            data["stack_trace"] = ''.join(
-                traceback.format_exception(*record.exc_info))
+            self._buffered_bytes += self._estimate_size(record)
+            if self.shouldFlush(record):
+                records = self._take_buffer()
+            else:
+                records = None
+                if self._buffer_since is None:
+                    # Start the flush_interval countdown
+                    self._buffer_since = time.monotonic()
+                    self._flush_condition.notify_all()
+
+        # Hand the batch over outside the lock so other threads can keep buffering
+        if records:
+            self._hand_over(records)
+
+    def _hand_over(self, records: deque) -> None:
+        """
+        Queue the records for the writer thread and wake it up. Once the
+        writer is stopping or gone, nothing would consume the queue, so the
+        records are written from the calling thread instead. The same goes
+        for records logged by the writer thread itself (e.g. from a message's
+        __str__), which must never wait for room only it can make.
+        """
+        if threading.current_thread() is self.flush_thread:
+            self._write_records(records)
+            return
 
-        # Store extra attributes as JSON
-        extra_attrs = {}
-        for key, value in record.__dict__.items():
-            if key not in logging.LogRecord.__dict__ and key not in data:
+        with self._flush_condition:
+            while not self._stopping and self.flush_thread.is_alive():
                 try:
-                    # Try to make the value JSON serializable
-                    json.dumps({key: value})
-                    extra_attrs[key] = value
-                except (TypeError, OverflowError):
-                    # Skip non-serializable values
-                    extra_attrs[key] = str(value)
+                    self._queue.put_nowait(records)
+                except queue.Full:
+                    # Wait for the writer to make room
+                    self._flush_condition.wait()
+                else:
+                    self._flush_condition.notify_all()
+                    return
 
-        if extra_attrs:
-            data["extra"] = json.dumps(extra_attrs)
+        self._write_records(records)
 
-        return data
+    def _estimate_size(self, record: logging.LogRecord) -> int:
+        """
+        Estimate the number of bytes the record will take once stored.
 
-    def flush(self) -> None:
-        """Write all buffered records to the database."""
-        if not self.buffer:
-            return
+        Runs in the logging thread, so it never calls __str__ on user objects
+        and falls back to a fixed size instead of raising.
+        """
+        try:
+            args = record.args or ()
+            if isinstance(args, Mapping):
+                args = args.values()
+
+            size = _RECORD_OVERHEAD_BYTES
+            for value in chain((record.msg,), args):
+                if isinstance(value, (str, bytes)):
+                    size += len(value)
+                else:
+                    size += _VALUE_ESTIMATE_BYTES
+
+            if record.exc_text:
+                size += len(record.exc_text)
+            elif record.exc_info:
+                size += _TRACEBACK_ESTIMATE_BYTES
+            return size
+        except Exception:
+            return _RECORD_OVERHEAD_BYTES
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        """Flush when either the record count or the byte estimate is reached."""
+        return (len(self.buffer) >= self.capacity or
+                self._buffered_bytes >= self.flush_num_bytes)
+
+    def _record_to_tuple(self, record: logging.LogRecord) -> Tuple[Any, ...]:
+        """Extract all useful data from the log record, in column order."""
+        # Skip Formatter processing unless the user configured one. The
+        # traceback has its own column, but stack_info is kept in the message
+        # as the default Formatter would
+        if self.formatter is None:
+            message = record.getMessage()
+            if record.stack_info:
+                message += '\n' + _DEFAULT_FORMATTER.formatStack(record.stack_info)
+        else:
+            message = self.format(record)
+
+        # Handle exception info if present
+        exception = str(record.exc_info[1]) if record.exc_info else None
 
-        with self.lock:
-            records = self.buffer
-            self.buffer = []
+        # Reuse the traceback text cached on the record by a Formatter; records
+        # unpickled from a SocketHandler only carry exc_text
+        stack_trace = record.exc_text or (
+            ''.join(traceback.format_exception(*record.exc_info))
+            if record.exc_info else None)
 
+        # Store extra attributes as JSON
+        skip_keys = self._extra_skip_keys
+        extra_attrs = {key: value for key, value in record.__dict__.items()
+                       if key not in skip_keys}
+        extra = _dumps(extra_attrs) if extra_attrs else None
+
+        # Custom fields are populated from attributes of the same name
+        additional = self._get_additional_fields(record)
+
+        return _get_record_attrs(record) + (
+            int(record.created * 1_000_000),
+            message,
+            exception,
+            stack_trace,
+            extra
+        ) + additional
+
+    def _take_buffer(self) -> deque:
+        """Swap out the current buffer and return its records."""
+        with self._buffer_lock:
+            records, self.buffer = self.buffer, deque()
+            self._buffered_bytes = 0
+            self._buffer_since = None
+        return records
+
+    def _write_records(self, records: deque) -> None:
+        """Insert the records into the database in a single transaction."""
         if not records:
             return
 
-        conn = self._get_conn()
-        cursor = conn.cursor()
-
         try:
-            # Prepare the SQL for batch insert
-            record_data = self._extract_record_data(records[0])
-            columns = list(record_data.keys())
-            placeholders = ', '.join(['?'] * len(columns))
-
-            insert_sql = f"""
-            INSERT INTO {self.table_name} ({', '.join(columns)})
-            VALUES ({placeholders})
-            """
-
-            # Extract data from all records
-            values = []
-            for record in records:
-                record_data = self._extract_record_data(record)
-                values.append(tuple(record_data[col] for col in columns))
-
-            # Execute batch insert
-            cursor.executemany(insert_sql, values)
-            conn.commit()
+            # Extract data before taking the write lock: formatting runs user
+            # code, which may log and re-enter this method
+            rows = iter([self._record_to_tuple(record) for record in records])
+
+            # Only one thread at a time may use the writer connection
+            with self._write_lock:
+                cursor = self._writer_conn.cursor()
+
+                # Execute batch insert in a single transaction
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    remainder = rows
+                    if self._rows_per_statement > 1:
+                        # Full chunks reuse the same multi-row INSERT
+                        num_rows = self._rows_per_statement
+                        while len(chunk := list(islice(rows, num_rows))) == num_rows:
+                            cursor.execute(self._multi_row_insert_sql,
+                                           list(chain.from_iterable(chunk)))
+                        remainder = chunk
+
+                    # The last, partial chunk goes through the single-row INSERT
+                    cursor.executemany(self._insert_sql, remainder)
+                    cursor.execute('COMMIT')
+                except Exception:
+                    cursor.execute('ROLLBACK')
+                    raise
 
         except Exception as e:
             # Don't let exceptions from the database affect the application
             print(f"Error in SQLiteLogHandler.flush: {e}")
 
+    def flush(self) -> None:
+        """
+        Write all buffered records to the database and wait until every
+        batch handed over to the writer thread has been written.
+        """
+        records = self._take_buffer()
+        if records:
+            self._hand_over(records)
+        self._queue.join()
+
     def close(self) -> None:
         """Close the handler and release resources."""
         if self._closed:
             return
         self._closed = True
 
-        # Stop background thread if running
-        if hasattr(self, 'flush_thread') and self.flush_thread.is_alive():
-            self.flush_thread_stop.set()
-            self.flush_thread.join(timeout=1.0)
+        # Write pending batches and stop the writer thread
+        if self.flush_thread.is_alive():
+            self.flush()
+            with self._flush_condition:
+                self._stopping = True
+                self._flush_condition.notify_all()
+            # The writer exits as soon as the queue is drained
+            self.flush_thread.join()
 
-        # Final flush
+        # Final flush of anything emitted meanwhile, written directly
         self.flush()
 
-        # Close all thread-local connections
-        if hasattr(self.local, 'conn'):
+        # Close the writer connection
+        with self._write_lock:
             try:
-                self.local.conn.close()
+                self._writer_conn.close()
             except:
                 pass
 
@@ -17,6 +17,9 @@ setup(
     download_url='https://github.com/rogervila/python_sqlite_log_handler/archive/CURRENT_VERSION.tar.gz',
     keywords=['sqlite', 'logging', 'handler'],
     install_requires=[],
+    extras_require={
+        'orjson': ['orjson'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',
@@ -7,25 +7,34 @@ import time
 import threading
 import tempfile
 import shutil
+import weakref
+import io
+import pathlib
+import collections
+import dataclasses
+from datetime import datetime
+from unittest import mock
+import contextlib
 from typing import List, Dict, Any
 from random import randint
 
 # Import the SQLiteLogHandler class - assuming it's in a module called sqlite_log_handler
 # If your module name is different, adjust this import
+import python_sqlite_log_handler
 from python_sqlite_log_handler import SQLiteLogHandler
 
 
 class test_SQLiteLogHandler(unittest.TestCase):
-    """Test cases for the SQLiteLogHandler class using file-based SQLite databases."""
+    """Test cases for the SQLiteLogHandler class using in-memory and file-based SQLite databases."""
 
     def setUp(self):
         """Set up test fixtures before each test."""
         # Create temporary directory for test databases
         self.test_dir = tempfile.mkdtemp(prefix=f'sqlite_log_test_{randint(1000, 9999)}')
 
-        # Create a file-based database for testing
-        self.db_path = os.path.join(
-            self.test_dir, f'test_logs_{randint(1000, 9999)}.db')
+        # Use a shared in-memory database to avoid disk I/O; tests that
+        # need a database file create their own in test_dir
+        self.db_path = f'file:test_logs_{randint(1000, 9999)}?mode=memory&cache=shared'
 
         self.table_name = "test_logs"
         self.handler = SQLiteLogHandler(
@@ -61,7 +70,7 @@ class test_SQLiteLogHandler(unittest.TestCase):
         if table_name is None:
             table_name = self.table_name
 
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, uri=True)
         cursor = conn.cursor()
 
         # Check if table exists
@@ -88,10 +97,25 @@ class test_SQLiteLogHandler(unittest.TestCase):
         conn.close()
         return results
 
+    def _wait_for_count(self, db_path, table_name, expected, timeout=2.0) -> int:
+        """Helper method to wait until the writer thread has stored the expected rows."""
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = sqlite3.connect(db_path)
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+            count = cursor.fetchone()[0]
+            conn.close()
+            if count >= expected or time.monotonic() > deadline:
+                return count
+            time.sleep(0.01)
+
     def test_basic_logging(self):
         """Test that basic log messages are stored correctly."""
         test_message = "This is a test log message"
+        before = time.time()
         self.logger.info(test_message)
+        after = time.time()
 
         # Force flush to ensure logs are written
         self.handler.flush()
@@ -99,14 +123,13 @@ class test_SQLiteLogHandler(unittest.TestCase):
         logs = self._get_all_logs()
         self.assertEqual(len(logs), 1)
         self.assertEqual(logs[0]['level_name'], 'INFO')
-        self.assertIn(test_message, logs[0]['message'])
+        self.assertEqual(logs[0]['message'], test_message)
         self.assertEqual(logs[0]['logger_name'], 'test_logger')
 
-        # Verify the file actually exists on disk
-        self.assertTrue(os.path.exists(self.db_path))
-
-        # Check file size is non-zero
-        self.assertGreater(os.path.getsize(self.db_path), 0)
+        # Timestamps are stored as integer microseconds since the epoch
+        self.assertIsInstance(logs[0]['created_at'], int)
+        self.assertGreaterEqual(logs[0]['created_at'], int(before * 1_000_000))
+        self.assertLessEqual(logs[0]['created_at'], int(after * 1_000_000))
 
     def test_log_levels(self):
         """Test that different log levels are stored correctly."""
@@ -143,6 +166,102 @@ class test_SQLiteLogHandler(unittest.TestCase):
         self.assertEqual(len(logs), 1)
         self.assertEqual(logs[0]['level_name'], 'ERROR')
         self.assertIn("division by zero", logs[0]['exception'])
+        self.assertIn("ZeroDivisionError", logs[0]['stack_trace'])
+
+    def test_non_str_key_extra(self):
+        """Test that an extra value with non-str keys doesn't lose the batch."""
+        self.logger.info("good 1")
+        self.logger.info("bad", extra={'d': {(1, 2): 'x'}})
+        self.logger.info("good 2")
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual([log['message'] for log in logs], ["good 1", "bad", "good 2"])
+        self.assertEqual(logs[1]['extra']['d'], str({(1, 2): 'x'}))
+
+    def test_extra_serialization_fallback(self):
+        """Test that extra data serializes the same with and without orjson."""
+        @dataclasses.dataclass
+        class Data:
+            a: int
+
+        Point = collections.namedtuple('Point', ['x', 'y'])
+
+        extra = {
+            'when': datetime(2024, 1, 2, 3, 4, 5),
+            'ratio': float('nan'),
+            'big': 2 ** 70,
+            'nested': {1: [float('inf'), 'x']},
+            'data': Data(a=1),
+            'point': Point(x=1, y=2)
+        }
+        expected = ('{"when":"2024-01-02T03:04:05","ratio":null,'
+                    '"big":1180591620717411303424,"nested":{"1":[null,"x"]},'
+                    '"data":"' + str(Data(a=1)) + '","point":[1,2]}')
+
+        with mock.patch.object(python_sqlite_log_handler, 'orjson', None):
+            self.assertEqual(python_sqlite_log_handler._dumps(extra), expected)
+
+        if python_sqlite_log_handler.orjson is not None:
+            del extra['big']  # Served by the fallback, checked above
+            self.assertEqual(
+                python_sqlite_log_handler._dumps(extra),
+                expected.replace('"big":1180591620717411303424,', ''))
+
+    def test_stack_info(self):
+        """Test that stack_info is kept in the message without a formatter."""
+        self.logger.info("With stack", stack_info=True)
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), 1)
+        self.assertTrue(logs[0]['message'].startswith("With stack\nStack (most recent call last):"))
+        self.assertIn("test_stack_info", logs[0]['message'])
+
+    def test_formatter(self):
+        """Test that a configured formatter is applied to the message."""
+        self.handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        self.logger.info("Formatted message")
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs[0]['message'], "[INFO] Formatted message")
+
+    def test_exc_text_reuse(self):
+        """Test that a pre-rendered exc_text is stored, even without exc_info."""
+        # Records received from a SocketHandler carry exc_text but no exc_info
+        record = logging.makeLogRecord({
+            'name': 'test_logger',
+            'levelno': logging.ERROR,
+            'levelname': 'ERROR',
+            'msg': "Remote failure",
+            'exc_text': "Traceback (most recent call last):\nRemoteError: boom"
+        })
+        self.logger.handle(record)
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), 1)
+        self.assertIsNone(logs[0]['exception'])
+        self.assertEqual(logs[0]['stack_trace'],
+                         "Traceback (most recent call last):\nRemoteError: boom")
+
+    def test_exc_text_from_formatter(self):
+        """Test that the traceback rendered by a formatter is reused for stack_trace."""
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            self.logger.exception("Formatted exception")
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), 1)
+        # Formatter.formatException strips the trailing newline, unlike
+        # traceback.format_exception, so this only holds for the cached text
+        self.assertFalse(logs[0]['stack_trace'].endswith("\n"))
+        self.assertEqual(logs[0]['message'], "Formatted exception\n" + logs[0]['stack_trace'])
 
     def test_extra_fields(self):
         """Test that extra fields are stored correctly."""
@@ -158,10 +277,32 @@ class test_SQLiteLogHandler(unittest.TestCase):
         logs = self._get_all_logs()
         self.assertEqual(len(logs), 1)
 
+        # Check the additional fields were stored in their own columns
+        self.assertEqual(logs[0]['test_field'], 'test_value')
+        self.assertEqual(logs[0]['request_id'], '12345')
+        self.assertNotIn('test_field', logs[0]['extra'])
+
         # Check the remaining extra data was saved as JSON
         self.assertIn('custom_data', logs[0]['extra'])
         self.assertEqual(logs[0]['extra']['custom_data']['key'], 'value')
 
+        # Standard LogRecord attributes are not duplicated into extra
+        self.assertNotIn('msg', logs[0]['extra'])
+        self.assertNotIn('levelname', logs[0]['extra'])
+
+    def test_non_serializable_extra(self):
+        """Test that non-serializable extra values are stored as strings."""
+        class Custom:
+            def __str__(self):
+                return "custom object"
+
+        self.logger.info("Message with custom object", extra={'obj': Custom()})
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs[0]['extra']['obj'], 'custom object')
+
     def test_buffer_capacity(self):
         """Test that logs are flushed when buffer capacity is reached."""
         # Create a file for this specific test
@@ -196,12 +337,8 @@ class test_SQLiteLogHandler(unittest.TestCase):
         # Log one more message to trigger flush
         logger.info("Final message")
 
-        # Check all messages were flushed
-        conn = sqlite3.connect(capacity_db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM capacity_test")
-        count = cursor.fetchone()[0]
-        conn.close()
+        # Check all messages were written by the writer thread
+        count = self._wait_for_count(capacity_db_path, "capacity_test", small_capacity)
         self.assertEqual(count, small_capacity)
 
         # Clean up
@@ -211,6 +348,73 @@ class test_SQLiteLogHandler(unittest.TestCase):
         self.assertTrue(os.path.exists(capacity_db_path))
         self.assertGreater(os.path.getsize(capacity_db_path), 0)
 
+    def test_buffer_bytes(self):
+        """Test that logs are flushed when the buffered byte estimate is reached."""
+        bytes_db_path = os.path.join(
+            self.test_dir, f"bytes_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=bytes_db_path,
+            table_name="bytes_test",
+            capacity=1000,  # Large capacity to ensure size triggers flush
+            flush_interval=60,
+            flush_num_bytes=10000
+        )
+
+        logger = logging.getLogger("bytes_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        # A small message stays buffered
+        logger.info("Small message")
+
+        conn = sqlite3.connect(bytes_db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM bytes_test")
+        count = cursor.fetchone()[0]
+        conn.close()
+        self.assertEqual(count, 0)
+
+        # A large message exceeds the byte threshold
+        logger.info("x" * 10000)
+
+        count = self._wait_for_count(bytes_db_path, "bytes_test", 2)
+        self.assertEqual(count, 2)
+
+        # Arguments count towards the threshold too
+        logger.info("%s", "y" * 10000)
+
+        count = self._wait_for_count(bytes_db_path, "bytes_test", 3)
+        self.assertEqual(count, 3)
+
+        handler.close()
+
+    def test_large_batch(self):
+        """Test that batches larger than one multi-row INSERT are fully stored."""
+        num_logs = self.handler._rows_per_statement * 2 + 1
+        self.handler.capacity = num_logs + 1
+
+        for i in range(num_logs):
+            self.logger.info(f"Batch message {i}", extra={'request_id': str(i)})  # pylint: disable=W1203
+
+        self.handler.flush()
+
+        logs = self._get_all_logs()
+        self.assertEqual(len(logs), num_logs)
+        self.assertEqual(logs[-1]['request_id'], str(num_logs - 1))
+
+    def test_unprintable_message(self):
+        """Test that a message whose __str__ raises never raises at the call site."""
+        class BadStr:
+            def __str__(self):
+                raise RuntimeError("no string for you")
+
+        self.logger.warning(BadStr())
+
+        # The failing batch is reported when written, not raised
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.handler.flush()
+
     def test_periodic_flush(self):
         """Test that logs are flushed periodically."""
         # Create a file for this specific test
@@ -344,9 +548,169 @@ class test_SQLiteLogHandler(unittest.TestCase):
         self.assertEqual(count, 1)
 
         # Verify thread was stopped
-        self.assertTrue(handler.flush_thread_stop.is_set())
+        self.assertTrue(handler._stopping)
         self.assertFalse(handler.flush_thread.is_alive())
 
+    def test_shutdown_with_pending_records(self):
+        """Test that logging.shutdown, which holds the handler lock around flush, does not deadlock."""
+        shutdown_db_path = os.path.join(
+            self.test_dir, f"shutdown_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=shutdown_db_path,
+            table_name="shutdown_test",
+            capacity=100,
+            flush_interval=0.01  # Let the writer thread wake up during shutdown
+        )
+
+        logger = logging.getLogger("shutdown_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        def flush_and_shutdown():
+            for i in range(10):
+                logger.info(f"Pending message {i}")  # pylint: disable=W1203
+                # What logging.shutdown() and dictConfig() do before closing
+                handler.acquire()
+                try:
+                    handler.flush()
+                finally:
+                    handler.release()
+
+            logger.info("Pending message at shutdown")
+            logging.shutdown([weakref.ref(handler)])
+
+        shutdown_thread = threading.Thread(target=flush_and_shutdown, daemon=True)
+        shutdown_thread.start()
+        shutdown_thread.join(timeout=5.0)
+        self.assertFalse(shutdown_thread.is_alive(), "logging.shutdown deadlocked")
+
+        logger.removeHandler(handler)
+
+        conn = sqlite3.connect(shutdown_db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM shutdown_test")
+        count = cursor.fetchone()[0]
+        conn.close()
+        self.assertEqual(count, 11)
+
+    def test_logging_from_message_str(self):
+        """Test that records logged while the writer formats a message don't deadlock."""
+        reentrant_db_path = os.path.join(
+            self.test_dir, f"reentrant_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=reentrant_db_path,
+            table_name="reentrant_test",
+            capacity=1,
+            queue_size=1
+        )
+
+        logger = logging.getLogger("reentrant_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        class LoggingStr:
+            def __str__(self):
+                logger.info("Logged from __str__")
+                return "Logging message"
+
+        def log_messages():
+            for _ in range(5):
+                logger.info(LoggingStr())
+            handler.flush()
+            handler.close()
+
+            # Direct writes after close must not deadlock either; they fail
+            # on the closed connection, which is printed, not raised
+            with contextlib.redirect_stdout(io.StringIO()):
+                logger.info(LoggingStr())
+
+        log_thread = threading.Thread(target=log_messages, daemon=True)
+        log_thread.start()
+        log_thread.join(timeout=10.0)
+        self.assertFalse(log_thread.is_alive(), "Re-entrant logging deadlocked")
+
+        logger.removeHandler(handler)
+
+        conn = sqlite3.connect(reentrant_db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM reentrant_test")
+        count = cursor.fetchone()[0]
+        conn.close()
+        self.assertEqual(count, 10)
+
+    def test_logging_after_close(self):
+        """Test that logging to a closed handler never blocks."""
+        closed_db_path = os.path.join(
+            self.test_dir, f"closed_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=closed_db_path,
+            table_name="closed_test",
+            capacity=2,
+            queue_size=2
+        )
+
+        logger = logging.getLogger("closed_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        handler.close()
+
+        def log_after_close():
+            # Write errors for the closed database are printed, not raised
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i in range(20):
+                    logger.info(f"Message after close {i}")  # pylint: disable=W1203
+
+        log_thread = threading.Thread(target=log_after_close, daemon=True)
+        log_thread.start()
+        log_thread.join(timeout=5.0)
+        self.assertFalse(log_thread.is_alive(), "Logging after close blocked")
+
+        logger.removeHandler(handler)
+
+    def test_close_while_logging(self):
+        """Test that close returns while other threads keep handing over batches."""
+        racing_db_path = os.path.join(
+            self.test_dir, f"racing_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=racing_db_path,
+            table_name="racing_test",
+            capacity=2,
+            queue_size=2
+        )
+
+        logger = logging.getLogger("racing_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        stop = threading.Event()
+
+        def keep_logging():
+            # Write errors after close are printed, not raised
+            while not stop.is_set():
+                logger.info("Racing message")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=keep_logging, daemon=True) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+
+            close_thread = threading.Thread(target=handler.close, daemon=True)
+            close_thread.start()
+            close_thread.join(timeout=10.0)
+
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=10.0)
+
+        self.assertFalse(close_thread.is_alive(), "close blocked")
+        self.assertFalse(any(thread.is_alive() for thread in threads), "Logging blocked")
+
+        logger.removeHandler(handler)
+
     def test_multiple_databases(self):
         """Test that multiple database files can be used simultaneously."""
         # Create two different database files
@@ -405,6 +769,88 @@ class test_SQLiteLogHandler(unittest.TestCase):
         handler1.close()
         handler2.close()
 
+    def test_defer_indexes(self):
+        """Test that indexes are only created once build_indexes is called."""
+        deferred_db_path = os.path.join(
+            self.test_dir, f"deferred_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=deferred_db_path,
+            table_name="deferred_logs",
+            defer_indexes=True
+        )
+
+        def get_indexes():
+            conn = sqlite3.connect(deferred_db_path)
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='deferred_logs'")
+            names = sorted(row[0] for row in cursor.fetchall())
+            conn.close()
+            return names
+
+        logger = logging.getLogger("deferred_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        logger.info("Bulk loaded message")
+        handler.flush()
+        self.assertEqual(get_indexes(), [])
+
+        handler.build_indexes()
+        self.assertEqual(get_indexes(), [
+            "idx_deferred_logs_created_at",
+            "idx_deferred_logs_level",
+            "idx_deferred_logs_logger_name"
+        ])
+
+        # Clean up
+        handler.close()
+
+    def test_durability(self):
+        """Test that the durability option sets the synchronous mode."""
+        durability_db_path = os.path.join(
+            self.test_dir, f"durability_test_{randint(1000, 9999)}.db")
+
+        handler = SQLiteLogHandler(
+            db_path=durability_db_path,
+            table_name="durability_logs",
+            durability="off"
+        )
+
+        cursor = handler._writer_conn.cursor()
+        cursor.execute("PRAGMA synchronous")
+        self.assertEqual(cursor.fetchone()[0], 0)  # OFF
+
+        handler.close()
+
+        with self.assertRaises(ValueError):
+            SQLiteLogHandler(db_path=durability_db_path, durability="fast")
+
+    def test_path_object(self):
+        """Test that db_path accepts path-like objects."""
+        path_db_path = pathlib.Path(self.test_dir) / f"path_test_{randint(1000, 9999)}.db"
+
+        handler = SQLiteLogHandler(db_path=path_db_path, table_name="path_logs")
+
+        logger = logging.getLogger("path_test")
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+
+        logger.info("Message to a Path database")
+        handler.flush()
+
+        conn = sqlite3.connect(path_db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT message FROM path_logs")
+        messages = cursor.fetchall()
+        conn.close()
+        self.assertEqual(messages, [("Message to a Path database",)])
+
+        # Clean up
+        logger.removeHandler(handler)
+        handler.close()
+
     def test_database_persistence(self):
         """Test that logs persist between handler instances."""
         persistence_db_path = os.path.join(